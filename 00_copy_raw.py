@@ -1,5 +1,6 @@
 ﻿from pathlib import Path
 import argparse
+import os
 import shutil
 
 from common import iter_markdown_files
@@ -12,7 +13,28 @@ def _warn_deprecated(flag: str, replacement: str) -> None:
     _WARNED.add(flag)
     print(f"[deprecation] {flag} is deprecated; use {replacement}")
 
-def main() -> None:
+def _copy_file(src: Path, dst: Path) -> None:
+    # copy_file_range lets the kernel clone/copy in place (reflink on Btrfs/XFS);
+    # anything it cannot handle falls back to shutil.copy2. A dst that is the same file
+    # (hardlink, bind mount) also goes to copy2, which raises SameFileError instead of
+    # letting open(dst, "wb") truncate the source.
+    if hasattr(os, "copy_file_range") and not (dst.exists() and os.path.samefile(src, dst)):
+        try:
+            remaining = os.stat(src).st_size
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                while remaining > 0:
+                    n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if n == 0:
+                        break
+                    remaining -= n
+            if remaining == 0:
+                shutil.copystat(src, dst)
+                return
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+
+def main(argv: list[str] | None = None) -> None:
     ap = argparse.ArgumentParser()
     ap.add_argument("--input_path", type=str, required=True, help="Path to a markdown file or a folder")
     ap.add_argument("--stage0_dir", type=str, default="stage_0_raw", help="Output folder for raw note copy")
@@ -20,7 +42,7 @@ def main() -> None:
     ap.add_argument("--no_recursive", action="store_true", help="If input_path is a folder, do not recurse")
     ap.add_argument("--exclude", action="append", default=[], help="Glob to exclude (repeatable)")
     ap.add_argument("--dry_run", action="store_true", help="Print what would happen; do not copy")
-    args = ap.parse_args()
+    args = ap.parse_args(argv)
 
     stage0_dir = args.stage0_dir
     if args.stage0_path:
@@ -75,7 +97,7 @@ def main() -> None:
             continue
 
         dst.parent.mkdir(parents=True, exist_ok=True)
-        shutil.copy2(src, dst)
+        _copy_file(src, dst)
 
     if not args.dry_run:
         print("[stage_0] copied")
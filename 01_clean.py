@@ -1,11 +1,13 @@
 ﻿from pathlib import Path
 import argparse
+import json
 import sys
+from typing import Any
 from common import (
     configure_stdout,
     extract_wikilinks,
     iter_markdown_files,
-    read_text,
+    read_text_with_hash,
     strip_yaml_frontmatter,
     normalize_markdown_light,
     parse_yaml_frontmatter,
@@ -26,8 +28,16 @@ def _console_safe(s: str) -> str:
     enc = sys.stdout.encoding or "utf-8"
     return s.encode(enc, errors="replace").decode(enc, errors="replace")
 
+def _json_safe_keys(obj: Any) -> Any:
+    # YAML allows non-string mapping keys (dates, ints); JSON object keys must be str.
+    if isinstance(obj, dict):
+        return {str(k): _json_safe_keys(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_json_safe_keys(v) for v in obj]
+    return obj
+
 def process_file(src: Path, stage1_root: Path, rel_path: Path, args: argparse.Namespace) -> None:
-    raw = read_text(src)
+    raw, source_hash = read_text_with_hash(src)
     body, yaml_block = strip_yaml_frontmatter(raw)
     yaml_error = None
     try:
@@ -47,6 +57,7 @@ def process_file(src: Path, stage1_root: Path, rel_path: Path, args: argparse.Na
     out_txt = stage1_root / rel_path
     out_txt = out_txt.with_suffix(".clean.txt")
     out_links_json = out_txt.with_suffix(".out_links.json")
+    out_meta_json = out_txt.with_suffix(".meta.json")
 
     print("[stage_1] ---- summary ----")
     print(f"[stage_1] file={src.name}")
@@ -67,13 +78,33 @@ def process_file(src: Path, stage1_root: Path, rel_path: Path, args: argparse.Na
     write_text(out_txt, cleaned_text)
     print(f"[stage_1] wrote: {out_txt}")
 
+    # Sidecar for stage_2 --prefer_stage1: frontmatter + source hash, keyed to the
+    # stage_0 file's size/mtime so stage_2 can tell when it is stale.
+    src_stat = src.stat()
+    # The sidecar is only an optimization: if the frontmatter cannot be represented
+    # as JSON (e.g. recursive YAML anchors), drop it and stage_2 re-reads stage_0.
+    try:
+        sidecar = {
+            "source_hash": source_hash,
+            "source_size": src_stat.st_size,
+            "source_mtime_ns": src_stat.st_mtime_ns,
+            "yaml_error": yaml_error,
+            "meta": _json_safe_keys(meta),
+        }
+        sidecar_json = json.dumps(sidecar, ensure_ascii=False, indent=2, default=str)
+    except (TypeError, ValueError, RecursionError) as exc:
+        out_meta_json.unlink(missing_ok=True)
+        print(f"[stage_1] warning: skipped {out_meta_json.name}: {type(exc).__name__}: {exc}")
+    else:
+        out_meta_json.write_text(sidecar_json, encoding="utf-8")
+        print(f"[stage_1] wrote: {out_meta_json}")
+
     if args.emit_links:
-        import json
         out_links_json.write_text(json.dumps(out_links, ensure_ascii=False, indent=2), encoding="utf-8")
         print(f"[stage_1] wrote: {out_links_json}")
 
 
-def main() -> None:
+def main(argv: list[str] | None = None) -> None:
     configure_stdout()
     ap = argparse.ArgumentParser()
     ap.add_argument("--stage0_path", type=str, required=True, help="Path to stage_0_raw file or folder")
@@ -84,7 +115,7 @@ def main() -> None:
     ap.add_argument("--exclude", action="append", default=[], help="Glob to exclude (repeatable)")
     ap.add_argument("--yaml_mode", type=str, choices=["strict", "lenient"], default="strict")
     ap.add_argument("--dry_run", action="store_true")
-    args = ap.parse_args()
+    args = ap.parse_args(argv)
 
     stage1_dir = args.stage1_dir
     if args.stage1_path:
@@ -1,20 +1,26 @@
 ﻿from pathlib import Path
 import argparse
+import contextlib
+import io
+import json
+import os
 import re
 import sys
 from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from itertools import repeat
+from typing import Dict, Iterator, Optional
 from common import (
     configure_stdout,
     iter_markdown_files,
     read_text,
+    read_text_with_hash,
     strip_yaml_frontmatter,
     parse_yaml_frontmatter,
     normalize_markdown_light,
     replace_wikilinks_and_collect,
-    sha256_bytes,
     sha256_text,
-    write_jsonl,
     split_into_sections,
     parse_date_field,
     generate_chunk_identity,
@@ -22,7 +28,9 @@ from common import (
     canonicalize_heading_path,
 )
 
-CHUNKER_VERSION = "v0.1"
+CHUNKER_VERSION = "v0.2"
+JSONL_WRITE_BUFFER = 1 << 20  # bytes; rows are streamed, not held in memory
+SENTENCE_BOUNDARY_RE = re.compile(r"(?<=[.!?])\s+")
 
 _WARNED: set[str] = set()
 
@@ -38,25 +46,43 @@ def _infer_stage0_root_for_file(path: Path) -> Path:
             return parent
     return path.parent
 
+def _iter_sentences(text: str) -> Iterator[str]:
+    # Same pieces as re.split(SENTENCE_BOUNDARY_RE, text), scanned once left-to-right
+    last = 0
+    for m in SENTENCE_BOUNDARY_RE.finditer(text):
+        yield text[last:m.start()]
+        last = m.end()
+    yield text[last:]
+
+def _load_stage1_sidecar(path: Path, src_stat: Optional[os.stat_result], yaml_mode: str) -> Optional[dict]:
+    """
+    Load the stage_1 .meta.json sidecar if it still describes the stage_0 file
+    (same size and mtime). Returns None whenever the full stage_0 read is needed.
+    """
+    if src_stat is None or not path.exists():
+        return None
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("meta"), dict) or not data.get("source_hash"):
+        return None
+    if data.get("source_size") != src_stat.st_size or data.get("source_mtime_ns") != src_stat.st_mtime_ns:
+        return None
+    if data.get("yaml_error") and yaml_mode == "strict":
+        return None  # re-parse so strict mode raises as before
+    return data
+
 def _console_safe(s: str) -> str:
     enc = sys.stdout.encoding or "utf-8"
     return s.encode(enc, errors="replace").decode(enc, errors="replace")
 
 
-def build_chunks(src: Path, stage0_root: Path, args: argparse.Namespace) -> tuple[list[dict], Path, str]:
-    raw_bytes = src.read_bytes()
-    raw_text = raw_bytes.decode("utf-8", errors="replace")
-
-    body, yaml_block = strip_yaml_frontmatter(raw_text)
-    yaml_error = None
-    try:
-        meta = parse_yaml_frontmatter(yaml_block or "")
-    except Exception as exc:
-        if args.yaml_mode == "strict":
-            raise
-        yaml_error = f"{type(exc).__name__}: {exc}"
-        meta = {}
-
+def build_chunks(src: Path, stage0_root: Path, args: argparse.Namespace) -> tuple[Iterator[dict], Path, Dict[str, int]]:
+    """
+    Prepare a document for chunking and return (rows, out_path, stats).
+    rows is a lazy iterator; stats["chunks"] is only final once rows is exhausted.
+    """
     if stage0_root.is_dir():
         rel = src.relative_to(stage0_root)
     else:
@@ -65,24 +91,43 @@ def build_chunks(src: Path, stage0_root: Path, args: argparse.Namespace) -> tupl
 
     stage1_path = Path(args.stage1_dir).resolve() / rel
     stage1_path = stage1_path.with_suffix(".clean.txt")
+    use_stage1 = args.prefer_stage1 and stage1_path.exists()
+    if args.prefer_stage1 and not use_stage1:
+        print(f"[stage_2] warning: prefer_stage1 set but missing: {stage1_path} (falling back to stage0)")
+
+    try:
+        src_stat = src.stat()
+    except OSError:
+        src_stat = None
+
+    sidecar = None
+    if use_stage1:
+        sidecar = _load_stage1_sidecar(stage1_path.with_suffix(".meta.json"), src_stat, args.yaml_mode)
 
-    if args.prefer_stage1 and stage1_path.exists():
+    if sidecar is not None:
+        # stage_1 already parsed the frontmatter and hashed this exact stage_0 file
+        meta = sidecar["meta"]
+        yaml_error = sidecar.get("yaml_error")
+        source_hash = sidecar["source_hash"]
         chunk_input = read_text(stage1_path)
     else:
-        if args.prefer_stage1 and not stage1_path.exists():
-            print(f"[stage_2] warning: prefer_stage1 set but missing: {stage1_path} (falling back to stage0)")
-        chunk_input = normalize_markdown_light(body)
+        raw_text, source_hash = read_text_with_hash(src)
+        body, yaml_block = strip_yaml_frontmatter(raw_text)
+        yaml_error = None
+        try:
+            meta = parse_yaml_frontmatter(yaml_block or "")
+        except Exception as exc:
+            if args.yaml_mode == "strict":
+                raise
+            yaml_error = f"{type(exc).__name__}: {exc}"
+            meta = {}
+        chunk_input = read_text(stage1_path) if use_stage1 else normalize_markdown_light(body)
 
     doc_id = str(meta.get("uuid") or "").strip() or stable_doc_id_from_rel_path(rel)
     rel_path = str(rel)
     source_uri = rel_path.replace("\\", "/")
     entry_date = parse_date_field(meta, "journal_entry_date")
-    source_hash = sha256_bytes(raw_bytes)
-    try:
-        mtime_ts = src.stat().st_mtime
-        source_date = datetime.fromtimestamp(mtime_ts).date().isoformat()
-    except OSError:
-        source_date = None
+    source_date = datetime.fromtimestamp(src_stat.st_mtime).date().isoformat() if src_stat else None
     parts = [p for p in rel.parts if p not in (".", "")]
     folder = parts[0] if parts else ""
     doc_type = str(meta.get("doc_type") or "").strip() or (folder.lower() if folder else "note")
@@ -94,102 +139,187 @@ def build_chunks(src: Path, stage0_root: Path, args: argparse.Namespace) -> tupl
     )
     heading_seen: defaultdict[str, int] = defaultdict(int)
 
-    rows = []
-    total_chunks = 0
-
-    for anchor, section_title, heading_path, section_raw in sections:
-        canon_heading_str = " > ".join(canonicalize_heading_path(heading_path))
-        ordinal = heading_seen[canon_heading_str]
-        heading_seen[canon_heading_str] += 1
-        section_ordinal = ordinal if heading_counts[canon_heading_str] > 1 else None
-        # normalize then replace links per chunk
-        normalized = normalize_markdown_light(section_raw)
-
-        # Split into paragraphs (blank-line separated)
-        paragraphs_raw = [p.strip() for p in normalized.split("\n\n") if p.strip()]
-
-        # Drop empty sections (this also drops "header-only" sections because header lines are no longer in section_raw)
-        if not paragraphs_raw:
-            continue
-
-        parts: list[str] = []
-        parts_links: list[list[dict]] = []
-
-        for para_raw in paragraphs_raw:
-            if len(para_raw) <= args.max_chars:
-                chunk_text, chunk_links = replace_wikilinks_and_collect(para_raw)
-                parts.append(chunk_text.strip() + "\n")
-                parts_links.append(chunk_links)
-            else:
-                # deterministic split for huge paragraphs
-                buf: list[str] = []
-                cur = 0
-                for piece in re.split(r"(?<=[.!?])\s+", para_raw):
-                    if cur + len(piece) + 1 > args.max_chars and buf:
+    stats = {"sections": len(sections), "chunks": 0}
+
+    # Document-level fields are filled once; None entries are per-section/per-chunk
+    # placeholders that keep the metadata key order of the JSONL output stable.
+    base_meta = {
+        "doc_id": doc_id,
+        "chunk_id": None,
+        "chunk_key": None,
+        "chunk_hash": None,
+        "chunk_anchor": None,
+        "chunk_title": None,
+        "heading_path": None,
+        "chunk_index": None,
+        "rel_path": rel_path,
+        "source_uri": None,
+        "cleaned_text": None,
+        "entry_date": entry_date,
+        "source_date": source_date,
+        "source_hash": source_hash,
+        "content_hash": None,
+        "folder": folder,
+        "doc_type": doc_type,
+        "sensitivity": sensitivity,
+        "chunker_version": CHUNKER_VERSION,
+        "out_links": None,
+    }
+    if yaml_error:
+        base_meta["yaml_error"] = yaml_error
+
+    def iter_rows() -> Iterator[dict]:
+        for anchor, section_title, heading_path, section_raw in sections:
+            canon_heading_str = " > ".join(canonicalize_heading_path(heading_path))
+            ordinal = heading_seen[canon_heading_str]
+            heading_seen[canon_heading_str] += 1
+            section_ordinal = ordinal if heading_counts[canon_heading_str] > 1 else None
+            section_meta = base_meta.copy()
+            section_meta["chunk_anchor"] = anchor
+            section_meta["chunk_title"] = section_title
+
+            # chunk_input is already normalized (stage_1 output or normalize_markdown_light above);
+            # sections are slices of it, so only paragraph splitting + link replacement remain here.
+            paragraphs_raw = [p.strip() for p in section_raw.split("\n\n") if p.strip()]
+
+            # Drop empty sections (this also drops "header-only" sections because header lines are no longer in section_raw)
+            if not paragraphs_raw:
+                continue
+
+            parts: list[str] = []
+            parts_links: list[list[dict]] = []
+
+            for para_raw in paragraphs_raw:
+                if len(para_raw) <= args.max_chars:
+                    chunk_text, chunk_links = replace_wikilinks_and_collect(para_raw)
+                    parts.append(chunk_text.strip() + "\n")
+                    parts_links.append(chunk_links)
+                else:
+                    # deterministic split for huge paragraphs
+                    buf: list[str] = []
+                    cur = 0
+                    for piece in _iter_sentences(para_raw):
+                        if cur + len(piece) + 1 > args.max_chars and buf:
+                            combined_raw = " ".join(buf)
+                            chunk_text, chunk_links = replace_wikilinks_and_collect(combined_raw)
+                            parts.append(chunk_text.strip() + "\n")
+                            parts_links.append(chunk_links)
+                            buf = []
+                            cur = 0
+                        buf.append(piece)
+                        cur += len(piece) + 1
+
+                    if buf:
                         combined_raw = " ".join(buf)
                         chunk_text, chunk_links = replace_wikilinks_and_collect(combined_raw)
                         parts.append(chunk_text.strip() + "\n")
                         parts_links.append(chunk_links)
-                        buf = []
-                        cur = 0
-                    buf.append(piece)
-                    cur += len(piece) + 1
-
-                if buf:
-                    combined_raw = " ".join(buf)
-                    chunk_text, chunk_links = replace_wikilinks_and_collect(combined_raw)
-                    parts.append(chunk_text.strip() + "\n")
-                    parts_links.append(chunk_links)
 
-        for idx, chunk_text in enumerate(parts):
-            identity = generate_chunk_identity(
-                source_uri,
-                heading_path,
-                idx,
-                chunk_text,
-                section_ordinal=section_ordinal,
-            )
-            chunk_id = identity["chunk_id"]
-            chunk_key = identity["chunk_key"]
-            chunk_hash = identity["chunk_hash"]
-            content_hash = sha256_text(chunk_text)
-
-            rows.append({
-                "text": chunk_text,
-                "metadata": {
-                    "doc_id": doc_id,
-                    "chunk_id": chunk_id,
-                    "chunk_key": chunk_key,
-                    "chunk_hash": chunk_hash,
-                    "chunk_anchor": anchor,
-                    "chunk_title": section_title,
-                    "heading_path": identity["heading_path"],
-                    "chunk_index": idx,
-                    "rel_path": rel_path,
-                    "source_uri": identity["source_uri"],
-                    "cleaned_text": chunk_text,
-                    "entry_date": entry_date,
-                    "source_date": source_date,
-                    "source_hash": source_hash,
-                    "content_hash": content_hash,
-                    "folder": folder,
-                    "doc_type": doc_type,
-                    "sensitivity": sensitivity,
-                    "chunker_version": CHUNKER_VERSION,
-                    "out_links": parts_links[idx],
-                    **({"yaml_error": yaml_error} if yaml_error else {}),
-                }
-            })
-            total_chunks += 1
+            for idx, chunk_text in enumerate(parts):
+                identity = generate_chunk_identity(
+                    source_uri,
+                    heading_path,
+                    idx,
+                    chunk_text,
+                    section_ordinal=section_ordinal,
+                )
+                meta = section_meta.copy()
+                meta["chunk_id"] = identity["chunk_id"]
+                meta["chunk_key"] = identity["chunk_key"]
+                meta["chunk_hash"] = identity["chunk_hash"]
+                meta["heading_path"] = identity["heading_path"]
+                meta["chunk_index"] = idx
+                meta["source_uri"] = identity["source_uri"]
+                meta["cleaned_text"] = chunk_text
+                meta["content_hash"] = sha256_text(chunk_text)
+                meta["out_links"] = parts_links[idx]
+
+                stats["chunks"] += 1
+                yield {"text": chunk_text, "metadata": meta}
 
     out_path = Path(args.out_dir).resolve() / rel
     out_path = out_path.with_suffix(".chunks.jsonl")
 
-    summary = f"sections={len(sections)} | chunks={total_chunks}"
-    return rows, out_path, summary
+    return iter_rows(), out_path, stats
+
+
+def write_rows_jsonl(rows: Iterator[dict], out_path: Path) -> Optional[dict]:
+    """
+    Stream rows to out_path through one buffered binary handle.
+    Writes go to a .tmp sibling that replaces out_path only after every row
+    passed the duplicate chunk_id check. Returns the first row (for preview).
+    """
+    tmp_path = out_path.with_suffix(".jsonl.tmp")
+    first_row = None
+    first_seen: Dict[str, tuple] = {}  # chunk_id -> (row, chunk_anchor, chunk_index) of first occurrence
+    try:
+        with tmp_path.open("wb", buffering=JSONL_WRITE_BUFFER) as f:
+            for row_num, row in enumerate(rows, start=1):
+                if first_row is None:
+                    first_row = row
+                meta = row.get("metadata", {})
+                cid = meta.get("chunk_id")
+                if cid:
+                    first = first_seen.get(cid)
+                    if first is not None:
+                        raise ValueError(
+                            "Duplicate chunk_id in output rows: "
+                            f"{cid} at row {row_num} | source_uri={meta.get('source_uri')} | "
+                            f"chunk_anchor={meta.get('chunk_anchor')} | "
+                            f"chunk_title={meta.get('chunk_title')} | "
+                            f"chunk_index={meta.get('chunk_index')}; "
+                            f"first seen at row {first[0]} (chunk_anchor={first[1]} | chunk_index={first[2]})"
+                        )
+                    first_seen[cid] = (row_num, meta.get("chunk_anchor"), meta.get("chunk_index"))
+                f.write(json.dumps(row, ensure_ascii=False).encode("utf-8"))
+                f.write(b"\n")
+        tmp_path.replace(out_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return first_row
+
+
+def chunk_file(src: Path, stage0_root: Path, args: argparse.Namespace) -> None:
+    print(f"[stage_2] src={src}")
+    rows, out_path, stats = build_chunks(src, stage0_root, args)
+
+    if args.dry_run:
+        first_row = next(rows, None)
+        for _ in rows:
+            pass
+    else:
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        first_row = write_rows_jsonl(rows, out_path)
+
+    print("[stage_2] ---- summary ----")
+    print(f"[stage_2] file={src.name}")
+    print(f"[stage_2] sections={stats['sections']} | chunks={stats['chunks']}")
+    print(f"[stage_2] out_path={out_path}")
+    if first_row:
+        print("[stage_2] first_chunk_preview:")
+        print(_console_safe(first_row["text"][:220].replace("\n", "\\n")))
+
+    if args.dry_run:
+        print("[stage_2] dry_run=True (no write performed)")
+        return
+
+    print("[stage_2] wrote jsonl")
 
 
-def main() -> None:
+def _chunk_file_captured(src: Path, stage0_root: Path, args: argparse.Namespace) -> str:
+    # Worker entry point: buffer this file's log so the parent prints logs in file order.
+    buf = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(buf):
+            chunk_file(src, stage0_root, args)
+    except Exception as exc:
+        exc.add_note(f"[stage_2] while chunking: {src}")
+        raise
+    return buf.getvalue()
+
+
+def main(argv: list[str] | None = None) -> None:
     configure_stdout()
     ap = argparse.ArgumentParser()
     ap.add_argument("--stage0_path", type=str, required=True, help="Path to stage_0_raw file or folder")
@@ -203,7 +333,8 @@ def main() -> None:
     ap.add_argument("--no_recursive", action="store_true", help="If stage0_path is a folder, do not recurse")
     ap.add_argument("--exclude", action="append", default=[], help="Glob to exclude (repeatable)")
     ap.add_argument("--yaml_mode", type=str, choices=["strict", "lenient"], default="strict")
-    args = ap.parse_args()
+    ap.add_argument("--workers", type=int, default=1, help="Parallel processes over files (0=cpu count) | default=1")
+    args = ap.parse_args(argv)
 
     stage1_dir = args.stage1_dir
     if args.stage1_path:
@@ -249,41 +380,17 @@ def main() -> None:
     if not args.dry_run:
         out_root.mkdir(parents=True, exist_ok=True)
 
-    for src in files:
-        print(f"[stage_2] src={src}")
-        rows, out_path, summary = build_chunks(src, stage0_root, args)
-
-        print("[stage_2] ---- summary ----")
-        print(f"[stage_2] file={src.name}")
-        print(f"[stage_2] {summary}")
-        print(f"[stage_2] out_path={out_path}")
-        if rows:
-            print("[stage_2] first_chunk_preview:")
-            print(_console_safe(rows[0]["text"][:220].replace("\n", "\\n")))
-
-        if args.dry_run:
-            print("[stage_2] dry_run=True (no write performed)")
-            continue
-
-        seen_ids: set[str] = set()
-        for row in rows:
-            cid = row.get("metadata", {}).get("chunk_id")
-            if not cid:
-                continue
-            if cid in seen_ids:
-                meta = row.get("metadata", {})
-                raise ValueError(
-                    "Duplicate chunk_id in output rows: "
-                    f"{cid} | source_uri={meta.get('source_uri')} | "
-                    f"chunk_anchor={meta.get('chunk_anchor')} | "
-                    f"chunk_title={meta.get('chunk_title')} | "
-                    f"chunk_index={meta.get('chunk_index')}"
-                )
-            seen_ids.add(cid)
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    if workers == 1 or len(files) == 1:
+        for src in files:
+            chunk_file(src, stage0_root, args)
+        return
 
-        out_path.parent.mkdir(parents=True, exist_ok=True)
-        write_jsonl(out_path, rows)
-        print("[stage_2] wrote jsonl")
+    # Notes are independent: chunk them in separate processes (the per-note work is
+    # pure-Python string handling, so threads would serialize on the GIL).
+    with ProcessPoolExecutor(max_workers=min(workers, len(files))) as ex:
+        for log in ex.map(_chunk_file_captured, files, repeat(stage0_root), repeat(args)):
+            print(log, end="")
 
 
 if __name__ == "__main__":
@@ -1,20 +1,25 @@
 ﻿from __future__ import annotations
 
 import argparse
+import functools
 import json
 import hashlib
+import queue
 import socket
 import subprocess
 import sys
+import threading
 import time
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Set, Tuple
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 import chromadb
+import numpy as np
+import orjson
 from sentence_transformers import SentenceTransformer
 import torch
-from common import configure_stdout
+from common import configure_stdout, shard_collection_names, shard_for_doc_id
 
 _WARNED: set[str] = set()
 
@@ -26,6 +31,8 @@ def _warn_deprecated(flag: str, replacement: str) -> None:
 
 PIPELINE_VERSION = "v1"
 STAGE3_VERSION = "v0.1"
+EXISTING_IDS_BATCH = 4096  # ids per collection.get when probing for existing ids
+ENCODE_POOL_CPU_WORKERS = 4  # --encode_pool worker processes on --device cpu
 
 CHROMA_META_KEYS = [
     "doc_id",
@@ -50,6 +57,9 @@ CHROMA_META_KEYS = [
     "sensitivity",
     "folder",
 ]
+REQUIRED_META_KEYS = ("chunk_id", "chunk_key", "chunk_hash", "source_uri", "chunk_index", "cleaned_text")
+# heading_path_str is derived from heading_path, everything else is copied as-is
+_PROJECTED_META_KEYS = tuple(k for k in CHROMA_META_KEYS if k != "heading_path_str")
 
 def stable_settings_hash(d: Dict[str, Any]) -> str:
     # Stable hash of settings (sorted keys) so runs are comparable
@@ -57,11 +67,9 @@ def stable_settings_hash(d: Dict[str, Any]) -> str:
     return hashlib.sha256(blob).hexdigest()[:16]
 
 def sha256_file(path: Path) -> str:
-    h = hashlib.sha256()
+    # file_digest reads into a C buffer (or straight from the fd), no Python-level chunk loop
     with path.open("rb") as f:
-        for chunk in iter(lambda: f.read(1024 * 1024), b""):
-            h.update(chunk)
-    return h.hexdigest()
+        return hashlib.file_digest(f, "sha256").hexdigest()
 
 def get_git_info(start_dir: Path) -> Tuple[Any, Any]:
     try:
@@ -92,56 +100,359 @@ def get_git_info(start_dir: Path) -> Tuple[Any, Any]:
         return None, None
 
 
+def resolve_precision(precision: str, device: str) -> str:
+    on_cuda = device.startswith("cuda")
+    if precision == "auto":
+        return "fp16" if on_cuda else "fp32"
+    if precision in ("fp16", "bf16") and not on_cuda:
+        raise ValueError(f"--precision {precision} requires a CUDA device")
+    if precision == "int8" and on_cuda:
+        raise ValueError("--precision int8 is CPU-only (dynamic quantization)")
+    return precision
+
+def apply_precision(model: Any, precision: str) -> Any:
+    # Low precision only affects the transformer forward pass; normalize_embeddings
+    # re-projects onto the unit sphere and Chroma still receives float vectors.
+    if precision == "fp16":
+        return model.half()
+    if precision == "bf16":
+        return model.bfloat16()
+    if precision == "int8":
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def load_model(embed_model: str, device: str, backend: str, onnx_cache_dir: Path) -> Any:
+    if backend == "torch":
+        return SentenceTransformer(embed_model, device=device)
+    # sentence-transformers exports to ONNX on first load (needs the optimum extra);
+    # the saved copy is reused so later runs skip the export. The directory name is a
+    # hash, so hub ids and local paths (drive letters, backslashes) always stay inside
+    # onnx_cache_dir; the readable name is kept in embed_model.txt.
+    cached = onnx_cache_dir / stable_settings_hash({"embed_model": embed_model})
+    name_file = cached / "embed_model.txt"
+    if (cached / "modules.json").exists() and name_file.exists() and name_file.read_text(encoding="utf-8") == embed_model:
+        print(f"[stage_3] onnx model cache hit: {cached}")
+        return SentenceTransformer(str(cached), device=device, backend="onnx")
+    model = SentenceTransformer(embed_model, device=device, backend="onnx")
+    model.save_pretrained(str(cached))
+    name_file.write_text(embed_model, encoding="utf-8")
+    print(f"[stage_3] onnx model exported to: {cached} ({embed_model})")
+    return model
+
+
+def encode_pool_devices(device: str, precision: str, backend: str) -> List[str]:
+    # Pool workers follow the resolved --device: every visible GPU only for a bare
+    # "cuda", the single named device for "cuda:N" (or other explicit devices),
+    # and N CPU workers for "cpu".
+    if backend != "torch":
+        raise ValueError("--encode_pool is only valid with --backend torch")
+    if precision == "int8":
+        raise ValueError("--encode_pool cannot ship an int8 dynamically quantized model to worker processes")
+    if device == "cuda":
+        n_gpus = torch.cuda.device_count()
+        if n_gpus == 0:
+            raise ValueError("--device cuda with --encode_pool but no CUDA devices are visible")
+        return [f"cuda:{i}" for i in range(n_gpus)]
+    if device == "cpu":
+        return ["cpu"] * ENCODE_POOL_CPU_WORKERS
+    return [device]
+
+
+def compile_model(model: Any) -> None:
+    # Compile only the HF transformer inside module 0; pooling/normalize stay eager.
+    # dynamic=True avoids a recompile per padded sequence length. Inductor keeps its
+    # compiled artifacts in an on-disk cache, so repeat runs skip most of the warmup.
+    first = model[0]
+    first.auto_model = torch.compile(first.auto_model, mode="reduce-overhead", dynamic=True)
+
+
+def encode_batch(model: Any, docs: List[str], batch_size: int, pool: Optional[Dict[str, Any]] = None) -> np.ndarray:
+    # Chroma accepts ndarrays directly; skipping .tolist() avoids boxing every float.
+    # With a pool, the window is split across the worker processes (one per device).
+    with torch.inference_mode():
+        embeddings = model.encode(
+            docs,
+            batch_size=min(batch_size, len(docs)),
+            convert_to_numpy=True,
+            normalize_embeddings=True,  # cosine-friendly
+            show_progress_bar=False,
+            pool=pool,
+        )
+    return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+
+def write_embedded(
+    mode: str,
+    collection: Any,
+    ids: List[str],
+    docs: List[str],
+    metas: List[Dict[str, Any]],
+    embeddings: np.ndarray,
+) -> None:
+    if mode != "upsert":
+        collection.add(ids=ids, documents=docs, metadatas=metas, embeddings=embeddings)
+        return
+    if hasattr(collection, "upsert"):
+        collection.upsert(ids=ids, documents=docs, metadatas=metas, embeddings=embeddings)
+        return
+    existing = find_existing_ids(collection, ids)
+    if existing:
+        collection.delete(ids=existing)
+    collection.add(ids=ids, documents=docs, metadatas=metas, embeddings=embeddings)
+
+
+class BackgroundWriter:
+    """
+    Writer thread(s) fed through a bounded queue, so the next batch is
+    embedded while earlier ones are written to Chroma. A writer failure is
+    re-raised on the calling thread at the next submit() or at close().
+    """
+
+    def __init__(self, write_fn: Callable[..., None], max_pending: int = 2, num_threads: int = 1) -> None:
+        self._write_fn = write_fn
+        self._queue: queue.Queue = queue.Queue(maxsize=max(max_pending, num_threads))
+        self._error: Optional[BaseException] = None
+        self._threads = [
+            threading.Thread(target=self._run, name=f"chroma_writer_{i}", daemon=True)
+            for i in range(num_threads)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                continue  # keep draining so submit() never blocks on a dead writer
+            try:
+                self._write_fn(*item)
+            except BaseException as exc:
+                self._error = exc
+
+    def _raise_if_failed(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+    def submit(self, *item: Any) -> None:
+        self._raise_if_failed()
+        self._queue.put(item)
+
+    def close(self) -> None:
+        for _ in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join()
+        self._raise_if_failed()
+
+
+def project_chunk_meta(m: Dict[str, Any], row_num: int) -> Dict[str, Any]:
+    # Single pass: validate required keys, then copy non-null Chroma keys (one dict.get each).
+    for k in REQUIRED_META_KEYS:
+        if m.get(k) in (None, ""):
+            raise ValueError(f"Missing required chunk metadata at row {row_num}")
+    out: Dict[str, Any] = {}
+    for k in _PROJECTED_META_KEYS:
+        v = m.get(k)
+        if v is not None:
+            out[k] = v
+    heading_path = m.get("heading_path") or []
+    if isinstance(heading_path, list):
+        out["heading_path_str"] = " > ".join(heading_path)
+    else:
+        out["heading_path_str"] = str(heading_path)
+    return out
+
+
 def iter_jsonl(path: Path) -> Iterable[Dict[str, Any]]:
-    with path.open("r", encoding="utf-8") as f:
+    # orjson parses the raw bytes, so lines are never decoded to str in Python.
+    with path.open("rb") as f:
         for line in f:
-            line = line.strip()
-            if not line:
+            if not line.strip():
                 continue
-            yield json.loads(line)
+            yield orjson.loads(line)
+
+
+def iter_jsonl_files(paths: List[Path]) -> Iterable[Dict[str, Any]]:
+    # One row stream across all inputs; duplicate checks and sync_deletes see the union.
+    for i, path in enumerate(paths, start=1):
+        if len(paths) > 1:
+            print(f"[stage_3] reading chunks file {i}/{len(paths)}: {path}")
+        yield from iter_jsonl(path)
+
+
+def chunks_file_provenance(path: Path) -> Dict[str, Any]:
+    st = path.stat()
+    return {
+        "chunks_jsonl_path_abs": str(path),
+        "chunks_jsonl_bytes": st.st_size,
+        "chunks_jsonl_mtime_utc": datetime.fromtimestamp(
+            st.st_mtime, tz=timezone.utc
+        ).isoformat().replace("+00:00", "Z"),
+        "chunks_jsonl_sha256": sha256_file(path),
+    }
 
 
-def batch(iterable: List[Any], n: int) -> List[List[Any]]:
-    return [iterable[i : i + n] for i in range(0, len(iterable), n)]
+def batch_ranges(n_total: int, n: int) -> Iterator[Tuple[int, int]]:
+    # (lo, hi) bounds for slicing; nothing proportional to n_total is allocated
+    for lo in range(0, n_total, n):
+        yield lo, min(lo + n, n_total)
 
-def find_existing_ids(collection: Any, ids: List[str], batch_size: int) -> List[str]:
+def find_existing_ids(
+    collection: Any,
+    ids: List[str],
+    batch_size: int = EXISTING_IDS_BATCH,
+    stop_at_first: bool = False,
+) -> List[str]:
+    # chromadb>=1.0 (pinned) supports include=[] for id-only lookups.
+    # stop_at_first: callers that only need "any exist?" skip the remaining batches.
     existing: List[str] = []
-    for idxs in batch(list(range(len(ids))), batch_size):
-        batch_ids = [ids[i] for i in idxs]
-        try:
-            res = collection.get(ids=batch_ids, include=[])
-        except TypeError:
-            res = collection.get(ids=batch_ids)
+    for lo, hi in batch_ranges(len(ids), batch_size):
+        res = collection.get(ids=ids[lo:hi], include=[])
         existing.extend(res.get("ids", []))
+        if stop_at_first and existing:
+            break
     return existing
 
-def get_existing_meta_by_id(collection: Any, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+def get_existing_hashes(
+    collection: Any,
+    ids: List[str],
+    batch_size: int = EXISTING_IDS_BATCH,
+) -> Dict[str, Any]:
+    # Only chunk_hash is kept; the fetched metadata dicts (cleaned_text included)
+    # are dropped as soon as each batch is read.
+    hashes: Dict[str, Any] = {}
+    for lo, hi in batch_ranges(len(ids), batch_size):
+        res = collection.get(ids=ids[lo:hi], include=["metadatas"])
+        for cid, m in zip(res.get("ids", []), res.get("metadatas") or []):
+            if m is not None:
+                hashes[cid] = m.get("chunk_hash")
+    return hashes
+
+
+def other_layout_collections(client: Any, collection: str, names: Set[str]) -> List[str]:
+    # Collections of this index under a different --shards layout: the unsharded
+    # <collection>, or <collection>_s<i> names outside the current shard range.
+    prefix = f"{collection}_s"
+    found: List[str] = []
+    for c in client.list_collections():
+        name = getattr(c, "name", c)
+        if name in names:
+            continue
+        if name == collection or (name.startswith(prefix) and name[len(prefix):].isdigit()):
+            found.append(name)
+    return sorted(found)
+
+
+def open_collection(
+    client: Any,
+    name: str,
+    mode: str,
+    metadata: Dict[str, Any],
+    embed_model: str,
+    settings_hash: str,
+    shards: int,
+) -> Any:
+    if mode == "rebuild":
+        try:
+            client.delete_collection(name=name)
+            print(f"[stage_3] deleted existing collection: {name}")
+        except Exception:
+            pass
+        return client.create_collection(name=name, metadata=metadata)
+
     try:
-        res = collection.get(ids=ids, include=["metadatas"])
-    except TypeError:
-        res = collection.get(ids=ids)
-    got_ids = res.get("ids", [])
-    metas = res.get("metadatas", []) or []
-    return {i: m for i, m in zip(got_ids, metas) if m is not None}
+        collection = client.get_collection(name=name)
+    except Exception:
+        collection = client.create_collection(name=name, metadata=metadata)
+        print(f"[stage_3] created collection: {name}")
+        return collection
+
+    print(f"[stage_3] using existing collection: {name}")
+    coll_meta = getattr(collection, "metadata", None) or {}
+    coll_model = coll_meta.get("embed_model")
+    coll_hash = coll_meta.get("settings_hash")
+    if coll_model and coll_model != embed_model:
+        raise ValueError(
+            "Collection embed_model mismatch. "
+            "Use --mode rebuild or a new --collection name."
+        )
+    if coll_hash and coll_hash != settings_hash:
+        raise ValueError(
+            "Collection settings_hash mismatch. "
+            "Use --mode rebuild or a new --collection name."
+        )
+    # Unsharded collections carry no "shards" key
+    coll_shards = int(coll_meta.get("shards") or 1)
+    if coll_shards != shards:
+        raise ValueError(
+            f"Collection shards mismatch ({name} has shards={coll_shards}, --shards {shards}). "
+            "Use --mode rebuild or a new --collection name."
+        )
+    return collection
 
 
-def main() -> None:
+def main(argv: list[str] | None = None) -> None:
     configure_stdout(errors="replace")
     start_dt = datetime.now(timezone.utc)
     start_perf = time.perf_counter()
     ap = argparse.ArgumentParser()
     ap.add_argument("--chunks_jsonl", type=str, default="stage_2_chunks.jsonl", help="default=stage_2_chunks.jsonl")
+    ap.add_argument(
+        "--chunks_jsonl_list",
+        type=str,
+        nargs="+",
+        help="Several chunks JSONL files ingested in one run (one model load, one client)",
+    )
     ap.add_argument("--persist_dir", type=str, default="stage_3_chroma", help="default=stage_3_chroma")
     ap.add_argument("--persist_path", type=str, help=argparse.SUPPRESS)
     ap.add_argument("--collection", type=str, default="v1_chunks", help="default=v1_chunks")
     ap.add_argument("--embed_model", type=str, default="sentence-transformers/all-MiniLM-L6-v2", help="default=sentence-transformers/all-MiniLM-L6-v2")
     ap.add_argument("--device", type=str, default="auto", help="auto|cpu|cuda | default=auto")
     ap.add_argument("--batch_size", type=int, default=32, help="default=32")
+    ap.add_argument("--write_batch", type=int, default=2048, help="Rows per Chroma add/upsert call | default=2048")
+    ap.add_argument(
+        "--precision",
+        type=str,
+        choices=["auto", "fp32", "fp16", "bf16", "int8"],
+        default="auto",
+        help="auto=fp16 on cuda, fp32 on cpu | bf16=cuda (Ampere+) | int8=cpu dynamic quantization | default=auto",
+    )
+    ap.add_argument("--compile", action="store_true", help="torch.compile the embedding model (slower first batch)")
+    ap.add_argument("--backend", type=str, choices=["torch", "onnx"], default="torch", help="default=torch")
+    ap.add_argument(
+        "--onnx_cache_dir",
+        type=str,
+        default="stage_3_onnx_cache",
+        help="Where --backend onnx keeps exported models | default=stage_3_onnx_cache",
+    )
+    ap.add_argument(
+        "--num_threads",
+        type=int,
+        default=0,
+        help="torch intra-op threads for CPU encode (0 = torch default: physical cores or OMP_NUM_THREADS) | default=0",
+    )
+    ap.add_argument(
+        "--encode_pool",
+        action="store_true",
+        help="Encode in worker processes: one per GPU for --device cuda, the named GPU for cuda:N, 4 for cpu",
+    )
+    ap.add_argument("--chroma_host", type=str, help="Write to a Chroma server (chroma run) instead of opening persist_dir")
+    ap.add_argument("--chroma_port", type=int, default=8000, help="default=8000")
+    ap.add_argument(
+        "--writer_threads",
+        type=int,
+        default=1,
+        help="Concurrent Chroma writes (requires --chroma_host when > 1) | default=1",
+    )
+    ap.add_argument("--shards", type=int, default=1, help="Split the collection into K <collection>_s<i> collections by doc_id | default=1")
     ap.add_argument("--mode", type=str, choices=["rebuild", "append", "upsert"], default="upsert")
     ap.add_argument("--skip_unchanged", action="store_true", help="When upserting, skip chunks whose hash hasn't changed")
     ap.add_argument("--sync_deletes", action="store_true", help="Delete stale chunks not present in input (upsert only)")
     ap.add_argument("--dry_run", action="store_true")
-    args = ap.parse_args()
+    args = ap.parse_args(argv)
 
     print(f"[stage_03_chroma] args: {args}")
 
@@ -153,30 +464,75 @@ def main() -> None:
         persist_dir = args.persist_path
     args.persist_dir = persist_dir
 
-    chunks_path = Path(args.chunks_jsonl).resolve()
+    if args.chunks_jsonl_list:
+        if args.chunks_jsonl != "stage_2_chunks.jsonl":
+            raise ValueError("Use only one of --chunks_jsonl or --chunks_jsonl_list")
+        chunks_paths = [Path(p).resolve() for p in args.chunks_jsonl_list]
+    else:
+        chunks_paths = [Path(args.chunks_jsonl).resolve()]
     persist_dir_path = Path(persist_dir).resolve()
 
-    if not chunks_path.exists():
-        raise FileNotFoundError(f"Missing chunks file: {chunks_path}")
-    if not chunks_path.is_file():
-        raise FileNotFoundError(f"chunks_jsonl must be a file: {chunks_path}")
+    for chunks_path in chunks_paths:
+        if not chunks_path.exists():
+            raise FileNotFoundError(f"Missing chunks file: {chunks_path}")
+        if not chunks_path.is_file():
+            raise FileNotFoundError(f"chunks_jsonl must be a file: {chunks_path}")
     if not args.collection or not args.collection.strip():
         raise ValueError("--collection must be a non-empty name")
     if args.sync_deletes and args.mode != "upsert":
         raise ValueError("--sync_deletes is only valid with --mode upsert")
+    if args.batch_size < 1 or args.write_batch < 1:
+        raise ValueError("--batch_size and --write_batch must be >= 1")
+    if args.encode_pool and args.compile:
+        raise ValueError("--compile cannot be combined with --encode_pool")
+    if args.shards < 1:
+        raise ValueError("--shards must be >= 1")
+    if args.num_threads < 0:
+        raise ValueError("--num_threads must be >= 0")
+    if args.writer_threads < 1:
+        raise ValueError("--writer_threads must be >= 1")
+    if args.writer_threads > 1 and not args.chroma_host:
+        raise ValueError("--writer_threads > 1 requires --chroma_host (PersistentClient has a single writer)")
 
     # Decide device
     if args.device == "auto":
         device = "cuda" if torch.cuda.is_available() else "cpu"
     else:
         device = args.device
+    precision = resolve_precision(args.precision, device)
+    if args.backend == "onnx":
+        if args.compile:
+            raise ValueError("--compile is only valid with --backend torch")
+        if args.precision == "auto":
+            precision = "fp32"
+        elif precision != "fp32":
+            raise ValueError("--backend onnx runs the exported fp32 graph; use --precision fp32 or auto")
+    pool_devices = encode_pool_devices(device, precision, args.backend) if args.encode_pool else []
+    if device.startswith("cuda"):
+        # TF32 tensor cores for any matmuls left in fp32
+        torch.set_float32_matmul_precision("high")
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+        try:
+            torch.set_num_interop_threads(max(1, args.num_threads // 2))
+        except RuntimeError:
+            pass  # interop pool is fixed once torch has run parallel work (e.g. in-process runs)
 
     index_settings = {
         "persist_dir_abs": str(persist_dir_path),
         "collection": args.collection,
         "embed_model": args.embed_model,
         "device": device,
+        "precision": precision,
+        "backend": args.backend,
+        "compile": args.compile,
+        "num_threads": args.num_threads,
+        "encode_pool": args.encode_pool,
+        "chroma_host": args.chroma_host,
+        "writer_threads": args.writer_threads,
+        "shards": args.shards,
         "batch_size": args.batch_size,
+        "write_batch": args.write_batch,
         "mode": args.mode,
         "sync_deletes": args.sync_deletes,
         "skip_unchanged": args.skip_unchanged,
@@ -185,7 +541,10 @@ def main() -> None:
         "collection": args.collection,
         "embed_model": args.embed_model,
         "device": device,
+        "precision": precision,
+        "backend": args.backend,
         "batch_size": args.batch_size,
+        "shards": args.shards,
         "mode": args.mode,
         "sync_deletes": args.sync_deletes,
         "skip_unchanged": args.skip_unchanged,
@@ -195,15 +554,17 @@ def main() -> None:
     ).hexdigest()
     settings_hash_short = settings_hash_full[:12]
 
-    required_keys = ["chunk_id", "chunk_key", "chunk_hash", "source_uri", "chunk_index", "cleaned_text"]
     hash_settings = {
         "pipeline_version": PIPELINE_VERSION,
         "stage3_version": STAGE3_VERSION,
         "embed_model": args.embed_model,
         "normalize_embeddings": True,
         "chroma_meta_keys": CHROMA_META_KEYS,
-        "required_keys": required_keys,
+        "required_keys": list(REQUIRED_META_KEYS),
     }
+    if args.shards > 1:
+        # Only sharded layouts add the key, so existing unsharded collections keep their hash
+        hash_settings["shards"] = args.shards
     collection_settings_hash = stable_settings_hash(hash_settings)
 
     print(
@@ -211,9 +572,15 @@ def main() -> None:
         f"mode={args.mode}"
     )
     print("[stage_3] ---- input summary ----")
-    print(f"[stage_3] chunks_jsonl={chunks_path}")
+    if len(chunks_paths) == 1:
+        print(f"[stage_3] chunks_jsonl={chunks_paths[0]}")
+    else:
+        print(f"[stage_3] chunks_jsonl_list files={len(chunks_paths)}")
     print(f"[stage_3] embed_model={args.embed_model}")
-    print(f"[stage_3] device={device} | cuda_available={torch.cuda.is_available()}")
+    print(
+        f"[stage_3] device={device} | cuda_available={torch.cuda.is_available()} | precision={precision} | "
+        f"torch_threads={torch.get_num_threads()} | interop_threads={torch.get_num_interop_threads()}"
+    )
     print(f"[stage_3] settings_hash={collection_settings_hash}")
 
     if args.dry_run:
@@ -225,57 +592,48 @@ def main() -> None:
     persist_dir_path.mkdir(parents=True, exist_ok=True)
 
     # Initialize model
-    model = SentenceTransformer(args.embed_model, device=device)
-
-    # Create Chroma persistent client
-    client = chromadb.PersistentClient(path=str(persist_dir_path))
-
-    if args.mode == "rebuild":
-        try:
-            client.delete_collection(name=args.collection)
-            print(f"[stage_3] deleted existing collection: {args.collection}")
-        except Exception:
-            pass
-        collection = client.create_collection(
-            name=args.collection,
-            metadata={
-                "pipeline_version": PIPELINE_VERSION,
-                "stage3_version": STAGE3_VERSION,
-                "embed_model": args.embed_model,
-                "device": device,
-                "settings_hash": collection_settings_hash,
-            },
-        )
+    model = load_model(args.embed_model, device, args.backend, Path(args.onnx_cache_dir).resolve())
+    model = apply_precision(model, precision)
+    if args.compile:
+        compile_model(model)
+
+    # Create Chroma client; run manifests are written to persist_dir either way
+    if args.chroma_host:
+        client = chromadb.HttpClient(host=args.chroma_host, port=args.chroma_port)
+        print(f"[stage_3] chroma server={args.chroma_host}:{args.chroma_port} | writer_threads={args.writer_threads}")
     else:
-        try:
-            collection = client.get_collection(name=args.collection)
-        except Exception:
-            collection = client.create_collection(
-                name=args.collection,
-                metadata={
-                    "pipeline_version": PIPELINE_VERSION,
-                    "stage3_version": STAGE3_VERSION,
-                    "embed_model": args.embed_model,
-                    "device": device,
-                    "settings_hash": collection_settings_hash,
-                },
+        client = chromadb.PersistentClient(path=str(persist_dir_path))
+
+    collection_names = shard_collection_names(args.collection, args.shards)
+    # Rows are routed by hash(doc_id) % shards, so a layout change would leave stale
+    # copies in collections that neither sync_deletes nor query.py look at.
+    stale_layout = other_layout_collections(client, args.collection, set(collection_names))
+    if stale_layout:
+        if args.mode != "rebuild":
+            raise ValueError(
+                f"Collection shard layout mismatch: found {stale_layout} for --shards {args.shards}. "
+                "Use --mode rebuild or a new --collection name."
             )
-            print(f"[stage_3] created collection: {args.collection}")
-        else:
-            print(f"[stage_3] using existing collection: {args.collection}")
-            coll_meta = getattr(collection, "metadata", None) or {}
-            coll_model = coll_meta.get("embed_model")
-            coll_hash = coll_meta.get("settings_hash")
-            if coll_model and coll_model != args.embed_model:
-                raise ValueError(
-                    "Collection embed_model mismatch. "
-                    "Use --mode rebuild or a new --collection name."
-                )
-            if coll_hash and coll_hash != collection_settings_hash:
-                raise ValueError(
-                    "Collection settings_hash mismatch. "
-                    "Use --mode rebuild or a new --collection name."
-                )
+        for name in stale_layout:
+            client.delete_collection(name=name)
+            print(f"[stage_3] deleted collection from previous shard layout: {name}")
+    collections: List[Any] = []
+    for shard, name in enumerate(collection_names):
+        coll_metadata = {
+            "pipeline_version": PIPELINE_VERSION,
+            "stage3_version": STAGE3_VERSION,
+            "embed_model": args.embed_model,
+            "device": device,
+            "settings_hash": collection_settings_hash,
+        }
+        if args.shards > 1:
+            coll_metadata["shard_index"] = shard
+            coll_metadata["shards"] = args.shards
+        collections.append(
+            open_collection(
+                client, name, args.mode, coll_metadata, args.embed_model, collection_settings_hash, args.shards
+            )
+        )
 
     incoming_ids_by_doc: Dict[str, Set[str]] = {}
     first_seen: Dict[str, Tuple[int, str]] = {}
@@ -284,17 +642,22 @@ def main() -> None:
     embedded_or_upserted = 0
     skipped_unchanged = 0
 
-    batch_ids: List[str] = []
-    batch_docs: List[str] = []
-    batch_metas: List[Dict[str, Any]] = []
+    # One pending (ids, docs, metas) write window per shard collection
+    pending: List[Tuple[List[str], List[str], List[Dict[str, Any]]]] = [([], [], []) for _ in collections]
 
-    def flush_batch() -> None:
-        nonlocal embedded_or_upserted, skipped_unchanged, batch_ids, batch_docs, batch_metas
+    pool: Optional[Dict[str, Any]] = None
+    writer: Optional[BackgroundWriter] = None
+
+    def flush_batch(shard: int) -> None:
+        nonlocal embedded_or_upserted, skipped_unchanged
+        batch_ids, batch_docs, batch_metas = pending[shard]
         if not batch_ids:
             return
+        pending[shard] = ([], [], [])
+        collection = collections[shard]
 
         if args.mode == "append":
-            existing = find_existing_ids(collection, batch_ids, batch_size=len(batch_ids))
+            existing = find_existing_ids(collection, batch_ids, stop_at_first=True)
             if existing:
                 sample = existing[:10]
                 raise ValueError(
@@ -303,126 +666,92 @@ def main() -> None:
 
         if args.mode == "upsert":
             if args.skip_unchanged:
-                existing_meta = get_existing_meta_by_id(collection, batch_ids)
+                prev_hash = get_existing_hashes(collection, batch_ids)
                 keep_ids: List[str] = []
                 keep_docs: List[str] = []
                 keep_metas: List[Dict[str, Any]] = []
                 for i, cid in enumerate(batch_ids):
-                    prev = existing_meta.get(cid)
-                    if prev and prev.get("chunk_hash") == batch_metas[i].get("chunk_hash"):
+                    if cid in prev_hash and prev_hash[cid] == batch_metas[i].get("chunk_hash"):
                         skipped_unchanged += 1
                         continue
                     keep_ids.append(cid)
                     keep_docs.append(batch_docs[i])
                     keep_metas.append(batch_metas[i])
                 if not keep_ids:
-                    batch_ids = []
-                    batch_docs = []
-                    batch_metas = []
                     return
                 batch_ids = keep_ids
                 batch_docs = keep_docs
                 batch_metas = keep_metas
 
-            embeddings = model.encode(
-                batch_docs,
-                batch_size=min(args.batch_size, len(batch_docs)),
-                convert_to_numpy=True,
-                normalize_embeddings=True,  # cosine-friendly
-                show_progress_bar=False,
-            )
-            embeddings_list = embeddings.tolist()
-            if hasattr(collection, "upsert"):
-                collection.upsert(
-                    ids=batch_ids,
-                    documents=batch_docs,
-                    metadatas=batch_metas,
-                    embeddings=embeddings_list,
-                )
-            else:
-                existing = find_existing_ids(collection, batch_ids, batch_size=len(batch_ids))
-                if existing:
-                    collection.delete(ids=existing)
-                collection.add(
-                    ids=batch_ids,
-                    documents=batch_docs,
-                    metadatas=batch_metas,
-                    embeddings=embeddings_list,
-                )
-            embedded_or_upserted += len(batch_docs)
-        else:
-            embeddings = model.encode(
-                batch_docs,
-                batch_size=min(args.batch_size, len(batch_docs)),
-                convert_to_numpy=True,
-                normalize_embeddings=True,  # cosine-friendly
-                show_progress_bar=False,
-            )
-            collection.add(
-                ids=batch_ids,
-                documents=batch_docs,
-                metadatas=batch_metas,
-                embeddings=embeddings.tolist(),
-            )
-            embedded_or_upserted += len(batch_docs)
-
-        batch_ids = []
-        batch_docs = []
-        batch_metas = []
-
-    for r in iter_jsonl(chunks_path):
-        rows_seen += 1
-        m = r.get("metadata", {})
-        missing = False
-        for k in required_keys:
-            if k not in m or m.get(k) in (None, ""):
-                missing = True
-                break
-        heading_path = m.get("heading_path") or []
-        if isinstance(heading_path, list):
-            heading_path_str = " > ".join(heading_path)
-        else:
-            heading_path_str = str(heading_path)
-        if heading_path_str is None:
-            missing = True
-        if missing:
-            raise ValueError(f"Missing required chunk metadata at row {rows_seen}")
-
-        chunk_id = m["chunk_id"]
-        source_uri = str(m.get("source_uri") or "")
-        if chunk_id in first_seen:
-            first_row, first_uri = first_seen[chunk_id]
-            raise ValueError(
-                "Duplicate chunk_id detected: "
-                f"{chunk_id} at row {rows_seen} (source_uri={source_uri}); "
-                f"first seen at row {first_row} (source_uri={first_uri})"
-            )
-        first_seen[chunk_id] = (rows_seen, source_uri)
-
-        doc_id = m.get("doc_id")
-        if args.sync_deletes and not doc_id:
-            raise ValueError(f"sync_deletes requires doc_id at row {rows_seen}")
-        if doc_id:
-            doc_id_str = str(doc_id)
-            incoming_ids_by_doc.setdefault(doc_id_str, set()).add(chunk_id)
-            doc_ids_seen.add(doc_id_str)
-
-        base = {k: m.get(k) for k in CHROMA_META_KEYS if k != "heading_path_str" and m.get(k) is not None}
-        base["heading_path_str"] = heading_path_str
+        # One encode call per write window: sentence-transformers length-sorts the whole
+        # window into --batch_size sub-batches (less padding) and returns input order.
+        embeddings = encode_batch(model, batch_docs, args.batch_size, pool)
+        writer.submit(collection, batch_ids, batch_docs, batch_metas, embeddings)
+        embedded_or_upserted += len(batch_docs)
 
-        batch_ids.append(chunk_id)
-        batch_docs.append(r["text"])
-        batch_metas.append(base)
+    try:
+        if pool_devices:
+            pool = model.start_multi_process_pool(target_devices=pool_devices)
+            print(f"[stage_3] encode_pool processes={len(pool['processes'])} | devices={pool_devices}")
+        writer = BackgroundWriter(
+            functools.partial(write_embedded, args.mode),
+            max_pending=2 * args.writer_threads,
+            num_threads=args.writer_threads,
+        )
 
-        if len(batch_ids) >= args.batch_size:
-            flush_batch()
+        for r in iter_jsonl_files(chunks_paths):
+            rows_seen += 1
+            meta = project_chunk_meta(r.get("metadata", {}), rows_seen)
 
-    flush_batch()
+            chunk_id = meta["chunk_id"]
+            source_uri = str(meta.get("source_uri") or "")
+            if chunk_id in first_seen:
+                first_row, first_uri = first_seen[chunk_id]
+                raise ValueError(
+                    "Duplicate chunk_id detected: "
+                    f"{chunk_id} at row {rows_seen} (source_uri={source_uri}); "
+                    f"first seen at row {first_row} (source_uri={first_uri})"
+                )
+            first_seen[chunk_id] = (rows_seen, source_uri)
+
+            doc_id = meta.get("doc_id")
+            if args.sync_deletes and not doc_id:
+                raise ValueError(f"sync_deletes requires doc_id at row {rows_seen}")
+            if args.shards > 1 and not doc_id:
+                raise ValueError(f"--shards requires doc_id at row {rows_seen}")
+            shard = 0
+            if doc_id:
+                doc_id_str = str(doc_id)
+                incoming_ids_by_doc.setdefault(doc_id_str, set()).add(chunk_id)
+                doc_ids_seen.add(doc_id_str)
+                if args.shards > 1:
+                    shard = shard_for_doc_id(doc_id_str, args.shards)
+
+            batch_ids, batch_docs, batch_metas = pending[shard]
+            batch_ids.append(chunk_id)
+            batch_docs.append(r["text"])
+            batch_metas.append(meta)
+
+            if len(batch_ids) >= args.write_batch:
+                flush_batch(shard)
+
+        for shard in range(len(collections)):
+            flush_batch(shard)
+    finally:
+        # close() re-raises a failed write; the encode workers (which may hold GPUs) are
+        # stopped regardless.
+        try:
+            if writer is not None:
+                writer.close()
+        finally:
+            if pool is not None:
+                model.stop_multi_process_pool(pool)
 
     docs_synced = 0
     chunks_deleted = 0
     if args.sync_deletes:
         for doc_id, incoming_ids in incoming_ids_by_doc.items():
+            collection = collections[shard_for_doc_id(doc_id, args.shards) if args.shards > 1 else 0]
             try:
                 res = collection.get(where={"doc_id": doc_id}, include=[])
             except TypeError:
@@ -432,8 +761,8 @@ def main() -> None:
             if not to_delete:
                 docs_synced += 1
                 continue
-            for idxs in batch(list(range(len(to_delete))), 256):
-                batch_del = [to_delete[i] for i in idxs]
+            for lo, hi in batch_ranges(len(to_delete), 256):
+                batch_del = to_delete[lo:hi]
                 collection.delete(ids=batch_del)
                 chunks_deleted += len(batch_del)
             docs_synced += 1
@@ -441,20 +770,23 @@ def main() -> None:
         print(f"[stage_3] sync_deletes docs_synced={docs_synced} | chunks_deleted={chunks_deleted}")
 
     print("[stage_3] ---- build summary ----")
-    print(f"[stage_3] wrote collection={args.collection} | total_added={embedded_or_upserted}")
+    print(
+        f"[stage_3] wrote collection={args.collection} | shards={args.shards} | "
+        f"total_added={embedded_or_upserted}"
+    )
     print(f"[stage_3] persist_dir={persist_dir_path}")
 
     finished_dt = datetime.now(timezone.utc)
     duration_s = time.perf_counter() - start_perf
     git_commit, git_dirty = get_git_info(Path(__file__).resolve().parent)
-    chunks_stat = chunks_path.stat()
-    chunks_jsonl_bytes = chunks_stat.st_size
-    chunks_jsonl_mtime_utc = datetime.fromtimestamp(
-        chunks_stat.st_mtime, tz=timezone.utc
-    ).isoformat().replace("+00:00", "Z")
-    chunks_jsonl_sha256 = sha256_file(chunks_path)
+    files_provenance = [chunks_file_provenance(p) for p in chunks_paths]
+    # Single-file runs keep the flat chunks_jsonl_* fields; multi-file runs list every file
+    if len(files_provenance) == 1:
+        input_file = files_provenance[0]
+    else:
+        input_file = dict.fromkeys(files_provenance[0], None)
     try:
-        final_collection_count = collection.count()
+        final_collection_count = sum(c.count() for c in collections)
     except Exception:
         final_collection_count = None
 
@@ -481,10 +813,7 @@ def main() -> None:
             "git_dirty": git_dirty,
         },
         "input_provenance": {
-            "chunks_jsonl_path_abs": str(chunks_path),
-            "chunks_jsonl_bytes": chunks_jsonl_bytes,
-            "chunks_jsonl_mtime_utc": chunks_jsonl_mtime_utc,
-            "chunks_jsonl_sha256": chunks_jsonl_sha256,
+            **input_file,
             "total_rows_read": rows_seen,
             "unique_doc_ids": len(doc_ids_seen),
             "unique_chunk_ids": len(first_seen),
@@ -498,6 +827,8 @@ def main() -> None:
             "errors_count": 0,
         },
     }
+    if len(files_provenance) > 1:
+        manifest["input_provenance"]["chunks_jsonl_files"] = files_provenance
     manifest_ts = finished_dt.strftime("%Y%m%d_%H%M%S")
     manifest_filename = f"run_manifest_{manifest_ts}_{settings_hash_short}.json"
     manifest_path = persist_dir_path / manifest_filename
@@ -514,9 +845,10 @@ def main() -> None:
         "started_at_utc": manifest["started_at_utc"],
         "finished_at_utc": manifest["finished_at_utc"],
         "duration_s": manifest["duration_s"],
-        "chunks_jsonl_sha256": chunks_jsonl_sha256,
-        "chunks_jsonl_mtime_utc": chunks_jsonl_mtime_utc,
-        "chunks_jsonl_path_abs": str(chunks_path),
+        "chunks_jsonl_sha256": input_file["chunks_jsonl_sha256"],
+        "chunks_jsonl_mtime_utc": input_file["chunks_jsonl_mtime_utc"],
+        "chunks_jsonl_path_abs": input_file["chunks_jsonl_path_abs"],
+        "chunks_jsonl_count": len(chunks_paths),
         "settings_hash_short": settings_hash_short,
         "pipeline_version": PIPELINE_VERSION,
         "stage3_version": STAGE3_VERSION,
@@ -524,7 +856,16 @@ def main() -> None:
         "collection": args.collection,
         "embed_model": args.embed_model,
         "device": device,
+        "precision": precision,
+        "backend": args.backend,
+        "compile": args.compile,
+        "num_threads": args.num_threads,
+        "encode_pool": args.encode_pool,
+        "chroma_host": args.chroma_host,
+        "writer_threads": args.writer_threads,
+        "shards": args.shards,
         "batch_size": args.batch_size,
+        "write_batch": args.write_batch,
         "mode": args.mode,
         "sync_deletes": args.sync_deletes,
         "skip_unchanged": args.skip_unchanged,
@@ -3,20 +3,25 @@ from __future__ import annotations
 import fnmatch
 import hashlib
 import json
+import mmap
+import os
 import re
 from dataclasses import dataclass
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 WIKILINK_RE = re.compile(r"\[\[([^\]|]+)(\|([^\]]+))?\]\]")  # [[Target]] or [[Target|Alias]]
 H2_RE = re.compile(r"^\s{0,3}##\s+(.*)$")  # split at H2 for V1
+BLANK_RUN_RE = re.compile(r"\n{3,}")  # 3+ newlines collapse to one blank line
 
 def ensure_dir(path: Path) -> None:
     path.mkdir(parents=True, exist_ok=True)
 
 def sha256_bytes(b: bytes) -> str:
-    return hashlib.sha256(b).hexdigest()
+    # Content fingerprint, not a security boundary (keeps FIPS-mode OpenSSL builds happy)
+    return hashlib.sha256(b, usedforsecurity=False).hexdigest()
 
 def sha256_text(s: str) -> str:
     return sha256_bytes(s.encode("utf-8", errors="replace"))
@@ -29,6 +34,15 @@ def stable_doc_id_from_rel_path(rel_path: Path, namespace: str = "obsidian") ->
     key = f"{namespace}:{rel_posix}"
     return sha256_text(key)[:24]
 
+def shard_collection_names(collection: str, shards: int) -> List[str]:
+    if shards <= 1:
+        return [collection]
+    return [f"{collection}_s{i}" for i in range(shards)]
+
+def shard_for_doc_id(doc_id: str, shards: int) -> int:
+    # All chunks of a note land in the same shard, so sync_deletes stays per-collection.
+    return int(blake2b_hex(doc_id, digest_size=8), 16) % shards
+
 def canonicalize_source_uri(source_uri: str) -> str:
     s = source_uri.strip().replace("\\", "/")
     s = re.sub(r"/{2,}", "/", s)
@@ -83,6 +97,17 @@ def generate_chunk_identity(
 def read_text(path: Path) -> str:
     return path.read_text(encoding="utf-8", errors="replace")
 
+def read_text_with_hash(path: Path) -> Tuple[str, str]:
+    """
+    Return (decoded text, sha256 of the raw bytes). Decodes and hashes straight
+    from an mmap of the file, so no intermediate bytes copy is made.
+    """
+    with path.open("rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return "", sha256_bytes(b"")  # empty files cannot be mmapped
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return str(mm, "utf-8", "replace"), sha256_bytes(mm)
+
 def write_text(path: Path, text: str) -> None:
     path.write_text(text, encoding="utf-8", newline="\n")
 
@@ -119,11 +144,16 @@ def parse_yaml_frontmatter(yaml_text: str) -> Dict[str, Any]:
         raise ValueError("Frontmatter YAML parsed but did not produce a dict/object.")
     return data
 
+_SLUG_DROP_RE = re.compile(r"[^\w\s-]")
+_SLUG_SEP_RE = re.compile(r"[\s_]+")
+_SLUG_DASHES_RE = re.compile(r"-{2,}")
+
+@lru_cache(maxsize=65536)  # heading titles repeat across notes (dates, "Notes", "Tasks", ...)
 def slugify(s: str) -> str:
     s = s.strip().lower()
-    s = re.sub(r"[^\w\s-]", "", s)
-    s = re.sub(r"[\s_]+", "-", s)
-    s = re.sub(r"-{2,}", "-", s)
+    s = _SLUG_DROP_RE.sub("", s)
+    s = _SLUG_SEP_RE.sub("-", s)
+    s = _SLUG_DASHES_RE.sub("-", s)
     return s.strip("-") or "section"
 
 def parse_source_date(meta: Dict[str, Any], filename: str) -> Optional[str]:
@@ -181,23 +211,26 @@ def normalize_markdown_light(md: str) -> str:
     - Replace blockquote markers but keep content
     - Collapse excessive blank lines
     """
-    lines = md.splitlines()
     out: List[str] = []
+    append = out.append
     in_code = False
 
-    for line in lines:
-        if line.strip().startswith("```"):
+    # splitlines() already drops line terminators; lstrip once and reuse it for
+    # the fence and blockquote checks.
+    for line in md.splitlines():
+        stripped = line.lstrip()
+        if stripped.startswith("```"):
             in_code = not in_code
             continue
 
-        if not in_code and line.lstrip().startswith(">"):
-            out.append(line.lstrip()[1:].lstrip())
+        if not in_code and stripped.startswith(">"):
+            append(stripped[1:].lstrip())
             continue
 
-        out.append(line.rstrip("\n"))
+        append(line)
 
     text = "\n".join(out)
-    text = re.sub(r"\n{3,}", "\n\n", text).strip() + "\n"
+    text = BLANK_RUN_RE.sub("\n\n", text).strip() + "\n"
     return text
 
 def replace_wikilinks_and_collect(text: str) -> Tuple[str, List[Dict[str, str]]]:
@@ -232,6 +265,13 @@ def extract_wikilinks(text: str) -> List[str]:
 
 HEADING_RE = re.compile(r"^\s{0,3}(#{1,6})\s+(.*)$")
 
+def _match_heading(line: str) -> Optional[re.Match]:
+    # HEADING_RE needs a "#" within the first 4 chars (<= 3 leading whitespace);
+    # plain-text lines fail that substring test without entering the regex engine.
+    if "#" not in line[:4]:
+        return None
+    return HEADING_RE.match(line)
+
 def split_into_sections(body_md: str) -> List[Tuple[str, str, List[str], str]]:
     """
     Split into sections by heading.
@@ -243,11 +283,9 @@ def split_into_sections(body_md: str) -> List[Tuple[str, str, List[str], str]]:
     """
     lines = body_md.splitlines()
 
-    levels_present = []
-    for line in lines:
-        m = HEADING_RE.match(line)
-        if m:
-            levels_present.append(len(m.group(1)))
+    # Match each line once; both the level scan and the split loop reuse the result.
+    matches = [_match_heading(line) for line in lines]
+    levels_present = {len(m.group(1)) for m in matches if m}
 
     if not levels_present:
         txt = "\n".join(lines).strip() + "\n"
@@ -259,7 +297,8 @@ def split_into_sections(body_md: str) -> List[Tuple[str, str, List[str], str]]:
     current_title = "preamble"
     current_path: List[str] = []
     current_lines: List[str] = []
-    heading_stack: Dict[int, str] = {}
+    # heading_stack[level] = open heading title at that level (index 0 unused), None if unset
+    heading_stack: List[Optional[str]] = [None] * 7
 
     def flush() -> None:
         nonlocal current_title, current_lines, current_path
@@ -267,21 +306,18 @@ def split_into_sections(body_md: str) -> List[Tuple[str, str, List[str], str]]:
         sections.append((anchor, current_title, current_path, current_lines))
         current_lines = []
 
-    for line in lines:
-        m = HEADING_RE.match(line)
+    for line, m in zip(lines, matches):
         if m:
             level = len(m.group(1))
             title = m.group(2).strip()
             # update stack
             heading_stack[level] = title
-            for k in list(heading_stack.keys()):
-                if k > level:
-                    del heading_stack[k]
+            heading_stack[level + 1 :] = [None] * (6 - level)
             if level == target_level:
                 # Start new section; DO NOT include the heading line in section_text
                 flush()
                 current_title = title
-                current_path = [heading_stack[l] for l in sorted(heading_stack.keys()) if l <= target_level]
+                current_path = [t for t in heading_stack[1 : target_level + 1] if t is not None]
                 continue
         current_lines.append(line)
 
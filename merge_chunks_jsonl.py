@@ -1,6 +1,8 @@
 from __future__ import annotations
 
 import argparse
+import os
+import shutil
 from pathlib import Path
 
 _WARNED: set[str] = set()
@@ -25,7 +27,33 @@ def iter_jsonl_files(root: Path, recursive: bool, output_path: Path) -> list[Pat
     )
 
 
-def main() -> None:
+def append_file_raw(out_f, path: Path) -> None:
+    # Byte-for-byte append (kernel-side sendfile where available). Stage 2 writes
+    # one JSON object per "\n"-terminated line, so only a missing final newline
+    # needs fixing up.
+    size = path.stat().st_size
+    if size == 0:
+        return
+    with path.open("rb") as in_f:
+        sent = 0
+        if hasattr(os, "sendfile"):
+            try:
+                while sent < size:
+                    n = os.sendfile(out_f.fileno(), in_f.fileno(), sent, size - sent)
+                    if n == 0:
+                        break
+                    sent += n
+            except OSError:
+                if sent:
+                    raise
+        if sent == 0:
+            shutil.copyfileobj(in_f, out_f, 1 << 20)
+        in_f.seek(-1, os.SEEK_END)
+        if in_f.read(1) != b"\n":
+            out_f.write(b"\n")
+
+
+def main(argv: list[str] | None = None) -> None:
     ap = argparse.ArgumentParser()
     ap.add_argument(
         "--chunks_dir",
@@ -44,8 +72,13 @@ def main() -> None:
         action="store_true",
         help="Do not recurse into subfolders",
     )
+    ap.add_argument(
+        "--validate",
+        action="store_true",
+        help="Re-read every line (strip whitespace, drop blank lines) instead of a raw byte concat",
+    )
     ap.add_argument("--dry_run", action="store_true")
-    args = ap.parse_args()
+    args = ap.parse_args(argv)
 
     chunks_dir = args.chunks_dir
     if args.chunks_path:
@@ -81,14 +114,20 @@ def main() -> None:
 
     output_path.parent.mkdir(parents=True, exist_ok=True)
 
-    with output_path.open("w", encoding="utf-8", newline="\n") as out_f:
-        for path in files:
-            with path.open("r", encoding="utf-8") as in_f:
-                for line in in_f:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    out_f.write(line + "\n")
+    if args.validate:
+        with output_path.open("w", encoding="utf-8", newline="\n") as out_f:
+            for path in files:
+                with path.open("r", encoding="utf-8") as in_f:
+                    for line in in_f:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        out_f.write(line + "\n")
+    else:
+        # Unbuffered so sendfile() and the newline fix-up write in order.
+        with output_path.open("wb", buffering=0) as out_f:
+            for path in files:
+                append_file_raw(out_f, path)
 
     print("[merge_chunks] wrote merged JSONL")
 
@@ -3,11 +3,12 @@ from __future__ import annotations
 import argparse
 import json
 from pathlib import Path
+from typing import Any, List
 
 import chromadb
 from sentence_transformers import SentenceTransformer
 import torch
-from common import configure_stdout
+from common import configure_stdout, shard_collection_names
 
 _WARNED: set[str] = set()
 
@@ -23,12 +24,30 @@ def preview(text: str, n: int = 180) -> str:
     return (t[:n] + "…") if len(t) > n else t
 
 
+def open_index_collections(client: Any, collection: str, shards: int) -> List[Any]:
+    # The shard layout is read from the collection metadata written by stage 3;
+    # --shards (if given) must agree with it.
+    try:
+        first = client.get_collection(name=collection)
+    except Exception:
+        try:
+            first = client.get_collection(name=f"{collection}_s0")
+        except Exception:
+            raise ValueError(f"Collection not found: {collection} (or sharded {collection}_s0)")
+    stored = int((first.metadata or {}).get("shards") or 1)
+    if shards and shards != stored:
+        raise ValueError(f"--shards {shards} does not match the index layout (shards={stored})")
+    names = shard_collection_names(collection, stored)
+    return [first] + [client.get_collection(name=name) for name in names[1:]]
+
+
 def main() -> None:
     configure_stdout(errors="replace")
     ap = argparse.ArgumentParser()
     ap.add_argument("--persist_dir", type=str, default="stage_3_chroma", help="default=stage_3_chroma")
     ap.add_argument("--persist_path", type=str, help=argparse.SUPPRESS)
     ap.add_argument("--collection", type=str, default="v1_chunks", help="default=v1_chunks")
+    ap.add_argument("--shards", type=int, default=0, help="0 = read the shard layout from the index | default=0")
     ap.add_argument("--query", type=str, required=True, help="required=True")
     ap.add_argument("--k", type=int, default=5, help="default=5")
     ap.add_argument("--embed_model", type=str, default="sentence-transformers/all-MiniLM-L6-v2", help="default=sentence-transformers/all-MiniLM-L6-v2")
@@ -64,8 +83,11 @@ def main() -> None:
     if not persist_dir_path.is_dir():
         raise NotADirectoryError(f"persist_dir must be a directory: {persist_dir_path}")
 
+    if args.shards < 0:
+        raise ValueError("--shards must be >= 0")
+
     client = chromadb.PersistentClient(path=str(persist_dir_path))
-    collection = client.get_collection(name=args.collection)
+    collections = open_index_collections(client, args.collection, args.shards)
 
     model = SentenceTransformer(args.embed_model, device=device)
     q_emb = model.encode([args.query], convert_to_numpy=True, normalize_embeddings=True)[0].tolist()
@@ -89,16 +111,25 @@ def main() -> None:
     else:
         n_results_query = args.k
 
-    res = collection.query(
-        query_embeddings=[q_emb],
-        n_results=n_results_query,
-        where=where,
-        include=["documents", "metadatas", "distances"],
-    )
-
-    docs = res["documents"][0]
-    metas = res["metadatas"][0]
-    dists = res["distances"][0]
+    docs = []
+    metas = []
+    dists = []
+    for collection in collections:
+        res = collection.query(
+            query_embeddings=[q_emb],
+            n_results=n_results_query,
+            where=where,
+            include=["documents", "metadatas", "distances"],
+        )
+        docs.extend(res["documents"][0])
+        metas.extend(res["metadatas"][0])
+        dists.extend(res["distances"][0])
+    if len(collections) > 1:
+        # Merge per-shard top-k lists into one global ranking by distance
+        order = sorted(range(len(dists)), key=dists.__getitem__)[:n_results_query]
+        docs = [docs[i] for i in order]
+        metas = [metas[i] for i in order]
+        dists = [dists[i] for i in order]
 
     if args.rel_path_prefix:
         prefix = args.rel_path_prefix.replace("\\", "/")
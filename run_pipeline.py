@@ -1,15 +1,17 @@
 from __future__ import annotations
 
 import argparse
-import subprocess
-import sys
+import importlib
 import shutil
 from pathlib import Path
 
 
-def run_cmd(args: list[str]) -> None:
-    print(f"[run_pipeline] cmd: {' '.join(args)}")
-    subprocess.run(args, check=True)
+def run_stage(script: str, argv: list[str]) -> None:
+    # Stages run in-process, so interpreter startup and the torch /
+    # sentence_transformers / chromadb imports are paid once per pipeline run.
+    print(f"[run_pipeline] stage: {script} {' '.join(argv)}")
+    module = importlib.import_module(Path(script).stem)
+    module.main(argv)
 
 
 def main() -> None:
@@ -51,7 +53,6 @@ def main() -> None:
     ap.add_argument("--dry_run", action="store_true")
     args = ap.parse_args()
 
-    python = sys.executable
     no_recursive_flag = ["--no_recursive"] if args.no_recursive else []
     dry_run_flag = ["--dry_run"] if args.dry_run else []
 
@@ -61,10 +62,9 @@ def main() -> None:
             print(f"[run_pipeline] removing stage0_dir: {stage0_dir}")
             shutil.rmtree(stage0_dir)
 
-    run_cmd(
+    run_stage(
+        "00_copy_raw.py",
         [
-            python,
-            "00_copy_raw.py",
             "--input_path",
             args.input_path,
             "--stage0_dir",
@@ -80,10 +80,9 @@ def main() -> None:
             print(f"[run_pipeline] removing stage1_dir: {stage1_dir}")
             shutil.rmtree(stage1_dir)
 
-    run_cmd(
+    run_stage(
+        "01_clean.py",
         [
-            python,
-            "01_clean.py",
             "--stage0_path",
             args.stage0_dir,
             "--stage1_dir",
@@ -100,10 +99,9 @@ def main() -> None:
             print(f"[run_pipeline] removing stage2_dir: {stage2_dir}")
             shutil.rmtree(stage2_dir)
 
-    run_cmd(
+    run_stage(
+        "02_chunk.py",
         [
-            python,
-            "02_chunk.py",
             "--stage0_path",
             args.stage0_dir,
             "--stage1_dir",
@@ -118,10 +116,9 @@ def main() -> None:
 
     merged_jsonl = None
     if args.merge_chunks:
-        run_cmd(
+        run_stage(
+            "merge_chunks_jsonl.py",
             [
-                python,
-                "merge_chunks_jsonl.py",
                 "--chunks_dir",
                 args.stage2_dir,
                 "--output_jsonl",
@@ -143,23 +140,22 @@ def main() -> None:
             files = sorted([p for p in chunks_dir.glob(pattern) if p.is_file()])
             if not files:
                 raise FileNotFoundError(f"No JSONL files found in: {chunks_dir}")
-            for path in files:
-                run_cmd(
-                    [
-                        python,
-                        "03_chroma.py",
-                        "--chunks_jsonl",
-                        str(path),
-                        "--persist_dir",
-                        args.persist_dir,
-                        "--collection",
-                        args.collection,
-                        *dry_run_flag,
-                        "--mode",
-                        args.mode,
-                        *(["--skip_unchanged"] if args.skip_unchanged else []),
-                    ]
-                )
+            # One stage 3 run for all files: the embedding model and Chroma client load once
+            run_stage(
+                "03_chroma.py",
+                [
+                    "--chunks_jsonl_list",
+                    *[str(path) for path in files],
+                    "--persist_dir",
+                    args.persist_dir,
+                    "--collection",
+                    args.collection,
+                    *dry_run_flag,
+                    "--mode",
+                    args.mode,
+                    *(["--skip_unchanged"] if args.skip_unchanged else []),
+                ]
+            )
         else:
             chunks_input = args.chunks_jsonl or merged_jsonl or args.merged_jsonl
             if not args.dry_run and not Path(chunks_input).exists():
@@ -167,10 +163,9 @@ def main() -> None:
                     "Missing chunks JSONL for stage 3. "
                     "Run with --merge_chunks or provide --chunks_jsonl."
                 )
-            run_cmd(
+            run_stage(
+                "03_chroma.py",
                 [
-                    python,
-                    "03_chroma.py",
                     "--chunks_jsonl",
                     chunks_input,
                     "--persist_dir",